@@ -0,0 +1,104 @@
+"""Filesystem scanning shared by the gallery generators."""
+from pathlib import Path
+from typing import Iterator
+import operator
+import os
+
+PROJECT_ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
+CHINESE_DIR = PROJECT_ROOT / "Chinese"
+
+# Plain-str form for the per-row hot loop, where Path arithmetic is costly.
+# os.path.join adds the trailing separator without doubling it when PROJECT_ROOT is "/".
+PROJECT_ROOT_S = os.path.join(str(PROJECT_ROOT), "")
+CHINESE_REL = CHINESE_DIR.relative_to(PROJECT_ROOT).as_posix()
+
+# Preferred extension when the same image exists in several formats
+IMAGE_EXT_ORDER = (".png", ".jpg", ".jpeg", ".webp")
+ALLOWED_EXTS = frozenset(IMAGE_EXT_ORDER)
+
+
+def _iter_images(directory: Path) -> Iterator[os.DirEntry]:
+    # DirEntry.is_file() is answered from the directory read, no stat() per entry
+    try:
+        it = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with it:
+        for e in it:
+            name = e.name
+            # One lower() per entry; the tuple endswith runs in C with no suffix parse
+            if name.startswith("._") or not name.lower().endswith(IMAGE_EXT_ORDER):
+                continue
+            # A dotfile like ".png" has no suffix, only an empty stem
+            if name.rfind(".") == 0:
+                continue
+            if e.is_file():
+                yield e
+
+
+def list_images(directory: Path) -> list[os.DirEntry]:
+    # Rows must follow name order across the whole directory, so sort once at the end
+    return sorted(_iter_images(directory), key=operator.attrgetter("name"))
+
+
+def scan_chinese() -> list[os.DirEntry]:
+    """Source images in CHINESE_DIR, sorted by name; re-read on every call."""
+    return list_images(CHINESE_DIR)
+
+
+def _index_dir(dir_path: str) -> dict[str, str]:
+    """
+    Map each image stem in dir_path to its filename, read with one scandir.
+    Stems are kept exactly as on disk; only the extension is compared case-insensitively.
+    If a stem exists with several extensions, the earliest in IMAGE_EXT_ORDER wins.
+    """
+    try:
+        it = os.scandir(dir_path)
+    except (FileNotFoundError, NotADirectoryError):
+        # Missing <section>/<method>/<base> folder: nothing to show for this cell
+        return {}
+    out: dict[str, str] = {}
+    with it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            name, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext not in ALLOWED_EXTS:
+                continue
+            current = out.get(name)
+            if current is None or IMAGE_EXT_ORDER.index(ext) < IMAGE_EXT_ORDER.index(
+                os.path.splitext(current)[1].lower()
+            ):
+                out[name] = entry.name
+    return out
+
+
+def cam_root(directory: Path) -> str:
+    """
+    POSIX path of a CAM method directory relative to PROJECT_ROOT, for pick_single_image.
+    Raises ValueError if directory is not under PROJECT_ROOT.
+    """
+    return directory.relative_to(PROJECT_ROOT).as_posix()
+
+
+def pick_single_image(root: str, base: str, method: str) -> str | None:
+    """
+    Choose a single representative image for the given method from <root>/<base>.
+    root is relative to PROJECT_ROOT, as returned by cam_root().
+    Preference order: *_<method>_cam.jpg, *_<method>_cam_gb.jpg, *_<method>_gb.jpg
+    Stems must match exactly; extensions match case-insensitively.
+    """
+    index = _index_dir(f"{PROJECT_ROOT_S}{root}/{base}")
+    if not index:
+        return None
+    roots = [
+        f"{base}_{method}_cam",
+        f"{base}_{method}_cam_gb",
+        f"{base}_{method}_gb",
+    ]
+    for stem in roots:
+        name = index.get(stem)
+        if name is not None:
+            return f"{root}/{base}/{name}"
+    return None
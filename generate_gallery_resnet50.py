@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from typing import Iterator
 import html
+import os
+import re
+import stat
+import tempfile
+
+from gallery_fs import CHINESE_REL, PROJECT_ROOT, cam_root, pick_single_image, scan_chinese
 
-PROJECT_ROOT = Path(__file__).resolve().parent
-CHINESE_DIR = PROJECT_ROOT / "Chinese"
 # Base folder containing 4 sections, each with layercam/scorecam subfolders
 BASE_DIR = PROJECT_ROOT / "12.17_ResNet50"
 SECTIONS = [
@@ -14,63 +22,45 @@ SECTIONS = [
 ]
 OUTPUT_HTML = PROJECT_ROOT / "index_resnet50.html"
 
-ALLOWED_EXTS = {".png", ".jpg", ".jpeg", ".webp"}
+# Section names repeat on every row, so they are stored already escaped
+SECTION_DIRS_S = [
+    (
+        html.escape(section),
+        cam_root(BASE_DIR / section / "layercam"),
+        cam_root(BASE_DIR / section / "scorecam"),
+    )
+    for section in SECTIONS
+]
 
+# Header cells per section; SECTIONS is fixed, so build them once at import
+_SECTION_TH_TOP = "".join(f'<th colspan="2">{html.escape(s)}</th>' for s in SECTIONS)
+_SECTION_TH_BOT = "<th>LayerCAM</th><th>ScoreCAM</th>" * len(SECTIONS)
 
-def list_images(directory: Path) -> list[Path]:
-    if not directory.exists():
-        return []
-    return sorted([
-        p for p in directory.iterdir()
-        if p.is_file() and p.suffix.lower() in ALLOWED_EXTS and not p.name.startswith("._")
-    ])
+# Threads used to scan CAM directories; the work is I/O-bound
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Rows submitted ahead of the writer
+ROW_WINDOW = SCAN_WORKERS * 2
 
 
-def pick_single_image(dir_path: Path, base: str, method: str) -> str | None:
-    """
-    Choose a single representative image for the given method.
-    Preference order: *_<method>_cam.jpg, *_<method>_cam_gb.jpg, *_<method>_gb.jpg
-    """
-    if not dir_path.exists():
-        return None
-    roots = [
-        f"{base}_{method}_cam",
-        f"{base}_{method}_cam_gb",
-        f"{base}_{method}_gb",
-    ]
-    for root in roots:
-        for ext in (".png", ".jpg", ".jpeg", ".webp"):
-            candidate = dir_path / f"{root}{ext}"
-            if candidate.exists():
-                return candidate.relative_to(PROJECT_ROOT).as_posix()
-    return None
-
-
-def build_rows():
-    chinese_images = list_images(CHINESE_DIR)
-    rows = []
-    for src in chinese_images:
-        base = src.stem  # e.g., Chinese_B_0044
-        chinese_rel = src.relative_to(PROJECT_ROOT).as_posix()
-
-        section_images: list[tuple[str, str | None, str | None]] = []
-        for section in SECTIONS:
-            # Paths like: BASE_DIR/section/layercam/<base>/<files>
-            layer_dir = BASE_DIR / section / "layercam" / base
-            score_dir = BASE_DIR / section / "scorecam" / base
-            layer_img = pick_single_image(layer_dir, base, "layercam")
-            score_img = pick_single_image(score_dir, base, "scorecam")
-            section_images.append((section, layer_img, score_img))
-
-        rows.append({
-            "base": base,
-            "chinese": chinese_rel,
-            "sections": section_images,
-        })
-    return rows
-
-
-def render_html(rows: list[dict]) -> str:
+def build_row(src: os.DirEntry) -> dict:
+    base = os.path.splitext(src.name)[0]  # e.g., Chinese_B_0044
+    chinese_rel = f"{CHINESE_REL}/{src.name}"
+
+    section_images: list[tuple[str, str | None, str | None]] = []
+    for section_esc, layer_root, score_root in SECTION_DIRS_S:
+        # Paths like: BASE_DIR/section/layercam/<base>/<files>
+        layer_img = pick_single_image(layer_root, base, "layercam")
+        score_img = pick_single_image(score_root, base, "scorecam")
+        section_images.append((section_esc, layer_img, score_img))
+
+    return {
+        "base": base,
+        "chinese": chinese_rel,
+        "sections": section_images,  # section names are HTML-escaped
+    }
+
+
+def render_head(row_count: int) -> str:
     # Table: [Chinese] then for each section: [LayerCAM] [ScoreCAM]
     css = """
     body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 16px; }
@@ -112,62 +102,126 @@ def render_html(rows: list[dict]) -> str:
 </head>
 <body>
   <h1>Pattern Viz Grid (ResNet50)</h1>
-  <div class=\"meta\">Source column: Chinese image. Then 4 sections (nopretrain_singlecrop, nopretrain_multicrop, pretrain_singlecrop, pretrain_multicrop), each with two columns: LayerCAM and ScoreCAM. Total rows: {len(rows)}</div>
+  <div class=\"meta\">Source column: Chinese image. Then 4 sections (nopretrain_singlecrop, nopretrain_multicrop, pretrain_singlecrop, pretrain_multicrop), each with two columns: LayerCAM and ScoreCAM. Total rows: {row_count}</div>
   <table>
     <thead>
       <tr>
         <th>Source (Chinese)</th>
-        {''.join(f'<th colspan=\"2\">{html.escape(section)}</th>' for section in [s for s, _, _ in rows[0]['sections']] ) if rows else ''}
+        {_SECTION_TH_TOP}
       </tr>
       <tr>
         <th></th>
-        {''.join('<th>LayerCAM</th><th>ScoreCAM</th>' for _ in ([s for s, _, _ in rows[0]['sections']] if rows else []))}
+        {_SECTION_TH_BOT}
       </tr>
     </thead>
     <tbody>
 """
 
-    body_parts = []
-    for row in rows:
-        base = html.escape(row["base"])
-        chinese_img = row["chinese"]
-        sections = row["sections"]
+    return head
 
-        cells = []
-        src_cell = f'''
-          <td>
-            <div class=\"row-title\">{base}</div>
-            <img class=\"thumb\" src=\"{html.escape(chinese_img)}\" alt=\"{base}\">
-          </td>
-        '''
-        cells.append(src_cell)
-
-        for section, layer_img, score_img in sections:
-            if layer_img:
-                cells.append(f'<td><img class=\"thumb\" src=\"{html.escape(layer_img)}\" alt=\"{base} {html.escape(section)} LayerCAM\"></td>')
-            else:
-                cells.append('<td></td>')
-            if score_img:
-                cells.append(f'<td><img class=\"thumb\" src=\"{html.escape(score_img)}\" alt=\"{base} {html.escape(section)} ScoreCAM\"></td>')
-            else:
-                cells.append('<td></td>')
-
-        row_html = "<tr>\n" + "\n".join(cells) + "\n</tr>"
-        body_parts.append(row_html)
-
-    tail = """
-    </tbody>
+
+TAIL = """    </tbody>
   </table>
 </body>
 </html>
 """
-    return head + "\n".join(body_parts) + tail
+
+# Same replacements as html.escape(s, quote=True), done in a single C-level pass
+_ESCAPE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+})
+
+# Image paths come from project-controlled filenames and almost never need escaping
+_NEEDS_ESCAPE = re.compile(r'[&<>"\']')
+
+
+def _esc(s: str) -> str:
+    return s.translate(_ESCAPE) if _NEEDS_ESCAPE.search(s) else s
+
+
+# CAM cell templates; each is preceded by the newline that separates cells
+_EMPTY_CELL = '\n<td></td>'
+_IMG_CELL = '\n<td><img class="thumb" src="%s" alt="%s %s %s"></td>'
+
+
+def render_row(row: dict) -> str:
+    base = _esc(row["base"])
+    chinese_img = _esc(row["chinese"])
+
+    parts = [f'''<tr>
+
+          <td>
+            <div class=\"row-title\">{base}</div>
+            <img class=\"thumb\" src=\"{chinese_img}\" alt=\"{base}\">
+          </td>
+        ''']
+
+    for section, layer_img, score_img in row["sections"]:
+        parts.append(_IMG_CELL % (_esc(layer_img), base, section, "LayerCAM") if layer_img else _EMPTY_CELL)
+        parts.append(_IMG_CELL % (_esc(score_img), base, section, "ScoreCAM") if score_img else _EMPTY_CELL)
+
+    parts.append("\n</tr>\n")
+    return "".join(parts)
+
+
+def _row_html(src: os.DirEntry) -> str:
+    return render_row(build_row(src))
+
+
+def iter_rows_html(chinese_images) -> Iterator[str]:
+    # Each row is 8 directory scans; threads overlap the syscall latency.
+    # At most ROW_WINDOW rows are in flight, so finished-but-unwritten rows stay
+    # bounded; they are yielded in the same order as chinese_images.
+    ex = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+    pending: deque[Future[str]] = deque()
+    try:
+        for src in chinese_images:
+            if len(pending) >= ROW_WINDOW:
+                yield pending.popleft().result()
+            pending.append(ex.submit(_row_html, src))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # On early exit (e.g. a failed write) drop queued scans instead of waiting
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
+def write_html(path: Path) -> None:
+    # Stream row by row so the whole document is never held in memory at once.
+    # Rows go to a temp file next to path, which replaces it only once complete,
+    # so a failed run leaves the previous gallery untouched.
+    chinese_images = scan_chinese()
+    tmp = tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", buffering=1024 * 1024,
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False,
+    )
+    try:
+        with tmp as f:
+            f.write(render_head(len(chinese_images)))
+            with closing(iter_rows_html(chinese_images)) as rows_html:
+                for tr in rows_html:
+                    f.write(tr)
+            f.write(TAIL)
+        # NamedTemporaryFile is created 0600; keep the output's existing mode
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp.name, mode)
+        os.replace(tmp.name, path)
+    except BaseException:
+        # Any early exit, including Ctrl-C mid-scan: closing() has already cancelled
+        # the queued scans by now, so only the partial temp file is left to remove
+        os.unlink(tmp.name)
+        raise
 
 
 def main():
-    rows = build_rows()
-    html_str = render_html(rows)
-    OUTPUT_HTML.write_text(html_str, encoding="utf-8")
+    write_html(OUTPUT_HTML)
     print(f"Wrote {OUTPUT_HTML}")
 
 